@@ -1,19 +1,17 @@
 import asyncio
 import threading
-import queue
 import os
-import time
 import sqlite3
-from typing import Union, cast, Optional, List, Dict, Any
+from typing import Union, Optional, List
 
 import gradio as gr
 import anthropic
-from anthropic.types import MessageParam, TextBlock, ToolUnionParam, ToolUseBlock
+from anthropic.types import MessageParam, TextBlock, ToolUseBlock
 from dotenv import load_dotenv
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
-from rich.console import Console
-from rich.markdown import Markdown
+
+from chat_common import McpTools, run_event_loop, tool_result_block, trim_history
 
 # Load environment variables
 load_dotenv()
@@ -21,9 +19,6 @@ load_dotenv()
 # Initialize Anthropic client
 anthropic_client = anthropic.AsyncAnthropic()
 
-# Create a console for rich text formatting
-console = Console()
-
 # Create server parameters for stdio connection
 server_params = StdioServerParameters(
     command="python",  # Executable
@@ -31,8 +26,8 @@ server_params = StdioServerParameters(
     env=None,  # Optional environment variables
 )
 
-# Global message queue for async communication
-message_queue = queue.Queue()
+# Seconds a query waits for the MCP server connection before giving up
+BACKEND_READY_TIMEOUT = 10
 
 # Check if database exists, if not create a sample one
 def initialize_database():
@@ -84,6 +79,12 @@ def initialize_database():
 class ChatProcessor:
     def __init__(self):
         self.messages: list[MessageParam] = []
+        self.tools = McpTools()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional[ClientSession] = None
+        self._ready = threading.Event()
+        self._backend_error: Optional[BaseException] = None
+        self._query_lock = threading.Lock()
         self.system_prompt: str = """You are a master SQLite assistant. 
         Your job is to use the tools at your disposal to execute SQL queries and provide the results to the user.
         
@@ -101,7 +102,14 @@ class ChatProcessor:
     
     def _start_mcp_server(self):
         """Initialize and run the MCP server connection"""
-        asyncio.run(self._run_server())
+        try:
+            run_event_loop(self._run_server())
+        except Exception as e:
+            print(f"MCP server connection failed: {str(e)}")
+            self._backend_error = e
+        finally:
+            # Wake up waiting queries so they can report the failure instead of hanging
+            self._ready.set()
     
     async def _run_server(self):
         """Run the MCP server and initialize the connection"""
@@ -110,31 +118,34 @@ class ChatProcessor:
                 # Initialize the connection
                 await session.initialize()
                 
-                # Process messages from the queue
-                while True:
-                    try:
-                        # Check if there are any messages in the queue
-                        if not message_queue.empty():
-                            query, response_callback = message_queue.get()
-                            result = await self._process_query(session, query)
-                            response_callback(result)
-                    except Exception as e:
-                        print(f"Error processing message: {str(e)}")
-                        
-                    # Short sleep to prevent CPU hogging
-                    await asyncio.sleep(0.1)
+                # Signal readiness so queries can be scheduled on this loop
+                self._loop = asyncio.get_running_loop()
+                self._session = session
+                self._ready.set()
+                
+                # Keep the session open for the lifetime of the process
+                await asyncio.Event().wait()
+    
+    def submit(self, query: str) -> List[str]:
+        """Run a query on the backend event loop and wait for the response messages"""
+        if not self._ready.wait(timeout=BACKEND_READY_TIMEOUT):
+            return ["Error: The MCP server is still starting, please try again."]
+        if self._backend_error is not None:
+            return [f"Error: The MCP server connection failed: {str(self._backend_error)}"]
+        # Queries share the conversation history, so process them one at a time
+        with self._query_lock:
+            try:
+                future = asyncio.run_coroutine_threadsafe(
+                    self._process_query(self._session, query), self._loop
+                )
+                return future.result()
+            except Exception as e:
+                print(f"Error processing message: {str(e)}")
+                return [f"Error processing message: {str(e)}"]
     
     async def _process_query(self, session: ClientSession, query: str) -> List[str]:
         """Process a query and return the response messages"""
-        response = await session.list_tools()
-        available_tools: list[ToolUnionParam] = [
-            {
-                "name": tool.name,
-                "description": tool.description or "",
-                "input_schema": tool.inputSchema,
-            }
-            for tool in response.tools
-        ]
+        available_tools = await self.tools.get_available_tools(session)
         
         # Add the user message to the conversation
         self.messages.append(
@@ -143,6 +154,7 @@ class ChatProcessor:
                 content=query,
             )
         )
+        trim_history(self.messages)
         
         # All Claude responses will be collected here
         all_responses = []
@@ -157,53 +169,57 @@ class ChatProcessor:
         )
 
         assistant_message_content: list[Union[ToolUseBlock, TextBlock]] = []
+        tool_uses: list[ToolUseBlock] = []
         for content in res.content:
             if content.type == "text":
                 assistant_message_content.append(content)
                 all_responses.append(content.text)
             elif content.type == "tool_use":
-                tool_name = content.name
-                tool_args = content.input
+                assistant_message_content.append(content)
+                tool_uses.append(content)
 
-                # Execute tool call
-                result = await session.call_tool(tool_name, cast(dict, tool_args))
+        if tool_uses:
+            # Execute tool calls concurrently
+            results = await asyncio.gather(
+                *(
+                    self.tools.call_tool(session, tool_use)
+                    for tool_use in tool_uses
+                ),
+                return_exceptions=True,
+            )
 
-                assistant_message_content.append(content)
-                self.messages.append(
-                    {"role": "assistant", "content": assistant_message_content}
-                )
-                self.messages.append(
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "tool_result",
-                                "tool_use_id": content.id,
-                                "content": getattr(result.content[0], "text", ""),
-                            }
-                        ],
-                    }
-                )
-                # Get next response from Claude
-                res = await anthropic_client.messages.create(
-                    model="claude-3-7-sonnet-latest",
-                    max_tokens=8000,
-                    messages=self.messages,
-                    tools=available_tools,
-                )
-                
-                response_text = getattr(res.content[0], "text", "")
-                self.messages.append(
-                    {
-                        "role": "assistant",
-                        "content": response_text,
-                    }
-                )
-                all_responses.append(response_text)
+            self.messages.append(
+                {"role": "assistant", "content": assistant_message_content}
+            )
+            self.messages.append(
+                {
+                    "role": "user",
+                    "content": [
+                        tool_result_block(tool_use, result)
+                        for tool_use, result in zip(tool_uses, results)
+                    ],
+                }
+            )
+            # Get next response from Claude
+            res = await anthropic_client.messages.create(
+                model="claude-3-7-sonnet-latest",
+                max_tokens=8000,
+                messages=self.messages,
+                tools=available_tools,
+            )
+            
+            response_text = getattr(res.content[0], "text", "")
+            self.messages.append(
+                {
+                    "role": "assistant",
+                    "content": response_text,
+                }
+            )
+            all_responses.append(response_text)
 
         return all_responses
 
-def submit_query(query: str, chat_history: list) -> tuple[list, list]:
+def submit_query(chat_processor: ChatProcessor, query: str, chat_history: list) -> tuple[list, list]:
     """Submit a query to the chat processor and update the chat history"""
     if not query.strip():
         return chat_history, chat_history
@@ -211,23 +227,11 @@ def submit_query(query: str, chat_history: list) -> tuple[list, list]:
     # Add user message to history immediately
     chat_history.append((query, None))
     
-    # Create a result container
-    result_container = []
-    
-    # Define callback for when the result is ready
-    def on_result(responses):
-        combined_response = "\n\n".join(responses)
-        result_container.append(combined_response)
-    
-    # Submit the query to the processor
-    message_queue.put((query, on_result))
-    
-    # Wait for the result
-    while not result_container:
-        time.sleep(0.1)
+    # Submit the query to the processor and wait for the result
+    responses = chat_processor.submit(query)
     
     # Update the last history entry with the response
-    chat_history[-1] = (query, result_container[0])
+    chat_history[-1] = (query, "\n\n".join(responses))
     
     return chat_history, chat_history
 
@@ -238,6 +242,9 @@ def main():
     # Initialize the chat processor
     chat_processor = ChatProcessor()
     
+    def handle_query(query: str, chat_history: list) -> tuple[list, list]:
+        return submit_query(chat_processor, query, chat_history)
+    
     # Create the Gradio interface
     with gr.Blocks(title="AI SQL Assistant", theme=gr.themes.Soft(), css="footer {visibility: hidden}") as demo:
         gr.Markdown("# AI SQL Assistant")
@@ -279,10 +286,10 @@ def main():
             )
         
         # Set up event handlers
-        submit.click(submit_query, [msg, chatbot], [chatbot, chatbot]).then(
+        submit.click(handle_query, [msg, chatbot], [chatbot, chatbot]).then(
             lambda: "", None, [msg]  # Clear the input box after submission
         )
-        msg.submit(submit_query, [msg, chatbot], [chatbot, chatbot]).then(
+        msg.submit(handle_query, [msg, chatbot], [chatbot, chatbot]).then(
             lambda: "", None, [msg]  # Clear the input box after submission
         )
         
@@ -0,0 +1,129 @@
+"""
+Runs many independent prompts through the Azure OpenAI Batch API.
+
+Intended for offline/regression runs (half the cost, 24h completion window); the Streamlit chat keeps using
+streaming. Requires a batch ("Global-Batch") deployment.
+
+Usage:
+    python azure_batch.py prompts.jsonl responses.jsonl [--tools tools.json]
+
+Each input line is either {"prompt": "..."} or {"messages": [...]}. Each output line is the assistant message
+for the input line at the same position.
+"""
+import argparse
+import asyncio
+import os
+from typing import Dict, List, Optional
+
+import orjson
+import openai
+from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+from dotenv import load_dotenv
+
+load_dotenv()
+
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
+AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
+AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
+AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-05-01-preview")
+BATCH_POLL_INTERVAL = 30  # Seconds between Batch API status checks
+
+
+def create_client() -> openai.AsyncAzureOpenAI:
+    """Creates an Azure OpenAI client, using the API key if set and Entra ID otherwise."""
+    if AZURE_OPENAI_API_KEY:
+        return openai.AsyncAzureOpenAI(
+            api_key=AZURE_OPENAI_API_KEY,
+            azure_endpoint=AZURE_OPENAI_ENDPOINT,
+            api_version=AZURE_OPENAI_API_VERSION,
+        )
+    return openai.AsyncAzureOpenAI(
+        azure_ad_token_provider=get_bearer_token_provider(
+            DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
+        ),
+        azure_endpoint=AZURE_OPENAI_ENDPOINT,
+        api_version=AZURE_OPENAI_API_VERSION,
+    )
+
+
+async def get_responses_batch(
+    client: openai.AsyncAzureOpenAI,
+    messages_list: List[List[Dict]],
+    available_tools: Optional[List[Dict]] = None,
+) -> List[Dict]:
+    """Submits one batch for all conversations, waits for it, and returns one assistant message per conversation, in order."""
+    lines = []
+    for index, messages in enumerate(messages_list):
+        body = {"model": AZURE_OPENAI_DEPLOYMENT_NAME, "messages": messages}
+        if available_tools:
+            body["tools"] = available_tools
+            body["tool_choice"] = "auto"
+        lines.append(orjson.dumps({"custom_id": f"request-{index}", "method": "POST", "url": "/chat/completions", "body": body}))
+
+    batch_file = await client.files.create(file=("batch.jsonl", b"\n".join(lines)), purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/chat/completions",
+        completion_window="24h",
+    )
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        batch = await client.batches.retrieve(batch.id)
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch.id} finished with status '{batch.status}'")
+
+    # Requests missing from the output file (they are listed in the batch's error file) keep this placeholder
+    results = [{"role": "assistant", "content": "Error: No result returned for this request."} for _ in messages_list]
+    if batch.output_file_id:
+        output = await client.files.content(batch.output_file_id)
+        for line in output.text.splitlines():
+            record = orjson.loads(line)
+            index = int(record["custom_id"].removeprefix("request-"))
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                results[index] = response["body"]["choices"][0]["message"]
+            else:
+                results[index] = {"role": "assistant", "content": f"Error: {record.get('error') or response.get('body')}"}
+    return results
+
+
+def read_prompts(path: str) -> List[List[Dict]]:
+    """Reads a prompts JSONL file into one message list per line."""
+    messages_list = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            if "messages" in record:
+                messages_list.append(record["messages"])
+            else:
+                messages_list.append([{"role": "user", "content": record["prompt"]}])
+    return messages_list
+
+
+async def main(args: argparse.Namespace) -> None:
+    messages_list = read_prompts(args.prompts)
+    available_tools = None
+    if args.tools:
+        with open(args.tools, "rb") as f:
+            available_tools = orjson.loads(f.read())
+
+    client = create_client()
+    try:
+        results = await get_responses_batch(client, messages_list, available_tools)
+    finally:
+        await client.close()
+
+    with open(args.responses, "wb") as f:
+        for message in results:
+            f.write(orjson.dumps(message) + b"\n")
+    print(f"Wrote {len(results)} responses to {args.responses}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run prompts through the Azure OpenAI Batch API.")
+    parser.add_argument("prompts", help="Input JSONL, one {\"prompt\": ...} or {\"messages\": [...]} per line")
+    parser.add_argument("responses", help="Output JSONL, one assistant message per input line")
+    parser.add_argument("--tools", help="JSON file with a list of OpenAI tool definitions")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,112 @@
+import asyncio
+from dataclasses import dataclass, field
+from typing import Any, Callable, Coroutine, Mapping, Optional, Sequence, cast
+
+from anthropic.types import MessageParam, ToolUnionParam, ToolUseBlock
+from mcp import ClientSession
+
+try:
+    import fastjsonschema
+except ImportError:  # Optional, tool arguments are then only validated by the server
+    fastjsonschema = None
+
+try:
+    import uvloop
+except ImportError:  # Optional, and not available on Windows
+    uvloop = None
+
+
+# Maximum number of messages resent to the model on each request, shared by all the chat clients
+MAX_HISTORY_MESSAGES = 32
+
+
+def history_start(messages: Sequence[Mapping[str, Any]], max_messages: int = MAX_HISTORY_MESSAGES) -> int:
+    """Index of the oldest message to resend, keeping at most max_messages where a whole turn allows"""
+    start = 0
+    if len(messages) <= max_messages:
+        return start
+    for i in range(1, len(messages)):
+        # Cut only at a user query so tool calls and their results stay together
+        if messages[i]["role"] == "user" and isinstance(messages[i]["content"], str):
+            start = i
+            if len(messages) - i <= max_messages:
+                break
+    return start
+
+
+def trim_history(messages: list[MessageParam], max_messages: int = MAX_HISTORY_MESSAGES) -> None:
+    """Drop the oldest turns so the history sent with each request stays bounded"""
+    del messages[: history_start(messages, max_messages)]
+
+
+def tool_result_block(tool_use: ToolUseBlock, result: Any) -> dict:
+    """Build the tool_result content block for a tool call or the exception it raised"""
+    if isinstance(result, BaseException):
+        return {
+            "type": "tool_result",
+            "tool_use_id": tool_use.id,
+            "content": f"Error: {str(result)}",
+            "is_error": True,
+        }
+    return {
+        "type": "tool_result",
+        "tool_use_id": tool_use.id,
+        "content": getattr(result.content[0], "text", ""),
+    }
+
+
+def compile_tool_validator(name: str, schema: dict) -> Optional[Callable]:
+    """Compile a tool's input schema, or return None to leave validation to the server"""
+    try:
+        # use_default=False, so validating never writes schema defaults into the stored tool_use input
+        return fastjsonschema.compile(schema, use_default=False)
+    except fastjsonschema.JsonSchemaDefinitionException as e:
+        print(f"Not validating arguments for tool '{name}' locally: {str(e)}")
+        return None
+
+
+@dataclass
+class McpTools:
+    """The tools listed by an MCP server, fetched once and reused on later turns"""
+
+    available_tools: Optional[list[ToolUnionParam]] = None
+    tool_names: frozenset[str] = frozenset()
+    tool_validators: dict[str, Callable] = field(default_factory=dict)
+
+    async def get_available_tools(self, session: ClientSession) -> list[ToolUnionParam]:
+        """List the server's tools once and reuse the schemas on later turns"""
+        if self.available_tools is None:
+            response = await session.list_tools()
+            self.available_tools = [
+                {
+                    "name": tool.name,
+                    "description": tool.description or "",
+                    "input_schema": tool.inputSchema,
+                }
+                for tool in response.tools
+            ]
+            self.tool_names = frozenset(tool.name for tool in response.tools)
+            if fastjsonschema is not None:
+                self.tool_validators = {}
+                for tool in response.tools:
+                    validator = compile_tool_validator(tool.name, tool.inputSchema)
+                    if validator is not None:
+                        self.tool_validators[tool.name] = validator
+        return self.available_tools
+
+    async def call_tool(self, session: ClientSession, tool_use: ToolUseBlock) -> Any:
+        """Call a tool requested by Claude, rejecting names the server never listed"""
+        if tool_use.name not in self.tool_names:
+            raise ValueError(f"Unknown tool '{tool_use.name}'")
+        validator = self.tool_validators.get(tool_use.name)
+        if validator is not None:
+            # Reject malformed arguments before the round trip to the server
+            validator(tool_use.input)
+        return await session.call_tool(tool_use.name, cast(dict, tool_use.input))
+
+
+def run_event_loop(main: Coroutine) -> Any:
+    """Run a coroutine to completion, on uvloop's faster event loop when it is installed"""
+    if uvloop is not None:
+        return uvloop.run(main)
+    return asyncio.run(main)
@@ -1,16 +1,24 @@
 import asyncio
 from dataclasses import dataclass, field
-from typing import Union, cast
+from typing import Union
 
 import anthropic
-from anthropic.types import MessageParam, TextBlock, ToolUnionParam, ToolUseBlock
+from anthropic.types import (
+    Message,
+    MessageParam,
+    TextBlock,
+    ToolUseBlock,
+)
 from dotenv import load_dotenv
 from mcp import ClientSession, StdioServerParameters
 from mcp.client.stdio import stdio_client
 
+from chat_common import McpTools, run_event_loop, tool_result_block, trim_history
+
 load_dotenv()
 
 
+# Single client for the whole session so its HTTP connection pool stays warm
 anthropic_client = anthropic.AsyncAnthropic()
 
 
@@ -25,23 +33,24 @@ server_params = StdioServerParameters(
 @dataclass
 class Chat:
     messages: list[MessageParam] = field(default_factory=list)
+    tools: McpTools = field(default_factory=McpTools)
 
     system_prompt: str = """You are a master SQLite assistant. 
     Your job is to use the tools at your dispoal to execute SQL queries and provide the results to the user."""
 
+    async def stream_response(self, **kwargs) -> Message:
+        """Print Claude's text as it is generated and return the final message"""
+        async with anthropic_client.messages.stream(**kwargs) as stream:
+            async for text in stream.text_stream:
+                print(text, end="", flush=True)
+            print()
+            return await stream.get_final_message()
+
     async def process_query(self, session: ClientSession, query: str) -> None:
-        response = await session.list_tools()
-        available_tools: list[ToolUnionParam] = [
-            {
-                "name": tool.name,
-                "description": tool.description or "",
-                "input_schema": tool.inputSchema,
-            }
-            for tool in response.tools
-        ]
+        available_tools = await self.tools.get_available_tools(session)
 
         # Initial Claude API call
-        res = await anthropic_client.messages.create(
+        res = await self.stream_response(
             model="claude-3-7-sonnet-latest",
             system=self.system_prompt,
             max_tokens=8000,
@@ -50,47 +59,49 @@ class Chat:
         )
 
         assistant_message_content: list[Union[ToolUseBlock, TextBlock]] = []
+        tool_uses: list[ToolUseBlock] = []
         for content in res.content:
             if content.type == "text":
                 assistant_message_content.append(content)
-                print(content.text)
             elif content.type == "tool_use":
-                tool_name = content.name
-                tool_args = content.input
-
-                # Execute tool call
-                result = await session.call_tool(tool_name, cast(dict, tool_args))
-
                 assistant_message_content.append(content)
-                self.messages.append(
-                    {"role": "assistant", "content": assistant_message_content}
-                )
-                self.messages.append(
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "tool_result",
-                                "tool_use_id": content.id,
-                                "content": getattr(result.content[0], "text", ""),
-                            }
-                        ],
-                    }
-                )
-                # Get next response from Claude
-                res = await anthropic_client.messages.create(
-                    model="claude-3-7-sonnet-latest",
-                    max_tokens=8000,
-                    messages=self.messages,
-                    tools=available_tools,
-                )
-                self.messages.append(
-                    {
-                        "role": "assistant",
-                        "content": getattr(res.content[0], "text", ""),
-                    }
-                )
-                print(getattr(res.content[0], "text", ""))
+                tool_uses.append(content)
+
+        if tool_uses:
+            # Execute tool calls concurrently
+            results = await asyncio.gather(
+                *(
+                    self.tools.call_tool(session, tool_use)
+                    for tool_use in tool_uses
+                ),
+                return_exceptions=True,
+            )
+
+            self.messages.append(
+                {"role": "assistant", "content": assistant_message_content}
+            )
+            self.messages.append(
+                {
+                    "role": "user",
+                    "content": [
+                        tool_result_block(tool_use, result)
+                        for tool_use, result in zip(tool_uses, results)
+                    ],
+                }
+            )
+            # Get next response from Claude
+            res = await self.stream_response(
+                model="claude-3-7-sonnet-latest",
+                max_tokens=8000,
+                messages=self.messages,
+                tools=available_tools,
+            )
+            self.messages.append(
+                {
+                    "role": "assistant",
+                    "content": getattr(res.content[0], "text", ""),
+                }
+            )
 
     async def chat_loop(self, session: ClientSession):
         while True:
@@ -101,18 +112,22 @@ class Chat:
                     content=query,
                 )
             )
+            trim_history(self.messages)
 
             await self.process_query(session, query)
 
     async def run(self):
-        async with stdio_client(server_params) as (read, write):
-            async with ClientSession(read, write) as session:
-                # Initialize the connection
-                await session.initialize()
+        try:
+            async with stdio_client(server_params) as (read, write):
+                async with ClientSession(read, write) as session:
+                    # Initialize the connection
+                    await session.initialize()
 
-                await self.chat_loop(session)
+                    await self.chat_loop(session)
+        finally:
+            # Release the pooled HTTP connections held by the shared client
+            await anthropic_client.close()
 
 
 chat = Chat()
-
-asyncio.run(chat.run())
\ No newline at end of file
+run_event_loop(chat.run())
\ No newline at end of file
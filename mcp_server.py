@@ -1,5 +1,7 @@
 # server.py
+import asyncio
 import sqlite3
+import threading
 
 from loguru import logger
 from mcp.server.fastmcp import FastMCP
@@ -7,20 +9,42 @@ from mcp.server.fastmcp import FastMCP
 # Create an MCP server
 mcp = FastMCP("Demo")
 
+DATABASE_PATH = "./database.db"
+
+# Shared connection, opened on first use and kept for the life of the server
+_conn: sqlite3.Connection | None = None
+# Queries run in worker threads, so access to the connection is serialized
+_conn_lock = threading.Lock()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Return the shared database connection, opening it if needed"""
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
+    return _conn
+
+
+def run_query(sql: str) -> str:
+    """Execute a SQL query on the shared connection and format the rows"""
+    with _conn_lock:
+        conn = get_connection()
+        try:
+            # Format rows straight off the cursor, so no list of row tuples is built (join still collects the strings)
+            result = "\n".join(str(row) for row in conn.execute(sql))
+            conn.commit()
+            return result
+        except Exception as e:
+            conn.rollback()
+            return f"Error: {str(e)}"
+
 
 @mcp.tool()
-def query_data(sql: str) -> str:
+async def query_data(sql: str) -> str:
     """Execute SQL queries safely"""
-    logger.info(f"Executing SQL query: {sql}")
-    conn = sqlite3.connect("./database.db")
-    try:
-        result = conn.execute(sql).fetchall()
-        conn.commit()
-        return "\n".join(str(row) for row in result)
-    except Exception as e:
-        return f"Error: {str(e)}"
-    finally:
-        conn.close()
+    logger.info("Executing SQL query: {}", sql)
+    # sqlite3 calls block, so keep them off the server's event loop
+    return await asyncio.to_thread(run_query, sql)
 
 
 @mcp.prompt()
@@ -1,15 +1,42 @@
 import streamlit as st
 import json
 import asyncio
+import copy
+import hashlib
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import AsyncExitStack
+import httpx
+import orjson # Faster JSON for the per-tool-call parse/serialize path
 import openai # Use openai library
 from azure.identity import DefaultAzureCredential, get_bearer_token_provider # Optional: for Entra ID auth
+from chat_common import history_start
 from mcp import ClientSession, StdioServerParameters, types as mcp_types
 from mcp.client.stdio import stdio_client
-from typing import List, Dict, Any, Optional, Tuple
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from typing import List, Dict, Any, Optional, Set, Tuple, Callable
+
+try:
+    import fastjsonschema # Optional: validates tool arguments locally before calling the server
+except ImportError:
+    fastjsonschema = None
 
 # --- Configuration ---
 CONFIG_FILE = "claude_desktop_config.json"
+DEFAULT_MAX_CONCURRENCY = 4 # In-flight tool calls per MCP server, override with "max_concurrency" in the server config
+RESPONSE_CACHE_TTL = 3600 # Seconds a cached Azure OpenAI response stays valid
+RESPONSE_CACHE_MAX_ENTRIES = 256
+HEARTBEAT_INTERVAL = 30 # Seconds between MCP heartbeat pings
+RECONNECT_DELAY = 5 # Base seconds for the reconnect backoff of a dropped MCP server
+RECONNECT_MAX_DELAY = 120 # Cap on the reconnect backoff
+STATUS_REFRESH_INTERVAL = 5 # Seconds between refreshes of the sidebar server status
+SESSION_GRACE_PERIOD = 120 # Seconds a browser session may stay disconnected before its loop and MCP servers are shut down
+TOOL_RESULT_INLINE_LIMIT = 4096 # Larger tool results from earlier turns are resent as a preview plus a reference
+TOOL_RESULT_PREVIEW_CHARS = 2048 # Leading characters of an offloaded result still sent inline
 
 # --- Azure OpenAI Configuration ---
 # Load from environment variables for better security, or define here for simplicity
@@ -17,6 +44,8 @@ AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY") # Required if not using Entra ID/Managed Identity
 AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME") # Your model deployment name
 AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-05-01-preview") # Use a recent API version supporting tools
+AZURE_OPENAI_TEMPERATURE = float(os.getenv("AZURE_OPENAI_TEMPERATURE")) if os.getenv("AZURE_OPENAI_TEMPERATURE") else None # Optional
+RESPONSE_CACHE_ENABLED = AZURE_OPENAI_TEMPERATURE == 0 # Only deterministic responses are safe to cache
 
 # --- Initialize Azure OpenAI Client ---
 # Use API Key Authentication (ensure AZURE_OPENAI_API_KEY is set)
@@ -30,45 +59,127 @@ AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-05-01-pre
 # Requires azure-identity library: pip install azure-identity
 # Ensure the environment where Streamlit runs has appropriate credentials configured
 # (e.g., logged in via Azure CLI, Managed Identity assigned, Service Principal env vars set)
-try:
-    token_provider = get_bearer_token_provider(DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default")
-    azure_openai_client = openai.AsyncAzureOpenAI(
-        azure_endpoint=AZURE_OPENAI_ENDPOINT,
-        api_version=AZURE_OPENAI_API_VERSION,
-        azure_ad_token_provider=token_provider,
+@st.cache_resource
+def get_token_provider() -> Callable[[], str]:
+    """Builds the Entra ID token provider once; DefaultAzureCredential probes several credential sources."""
+    return get_bearer_token_provider(DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default")
+
+# Created once per browser session and kept in session state: its HTTP connection pool survives reruns,
+# and stays bound to the session's own background event loop, the only loop that uses it
+def get_azure_client(endpoint: Optional[str], api_version: str, api_key: Optional[str]) -> Optional[openai.AsyncAzureOpenAI]:
+    """Creates an Azure OpenAI client backed by a pooled httpx.AsyncClient."""
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+        timeout=60.0,
     )
-    st.sidebar.info("Using Azure Entra ID / Managed Identity Auth")
-except Exception as e:
-    st.sidebar.warning(f"Entra ID/Managed Identity auth failed: {e}. Falling back to API Key auth.")
-    if AZURE_OPENAI_API_KEY:
-         azure_openai_client = openai.AsyncAzureOpenAI(
-            api_key=AZURE_OPENAI_API_KEY,
-            azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_version=AZURE_OPENAI_API_VERSION,
+    try:
+        client = openai.AsyncAzureOpenAI(
+            azure_endpoint=endpoint,
+            api_version=api_version,
+            azure_ad_token_provider=get_token_provider(),
+            http_client=http_client,
         )
-         st.sidebar.info("Using API Key Auth")
-    else:
-         st.error("Azure OpenAI API Key not found. Please set AZURE_OPENAI_API_KEY environment variable.")
-         azure_openai_client = None # Prevent app from running further if no auth method works
+        st.sidebar.info("Using Azure Entra ID / Managed Identity Auth")
+        return client
+    except Exception as e:
+        st.sidebar.warning(f"Entra ID/Managed Identity auth failed: {e}. Falling back to API Key auth.")
+        if api_key:
+             client = openai.AsyncAzureOpenAI(
+                api_key=api_key,
+                azure_endpoint=endpoint,
+                api_version=api_version,
+                http_client=http_client,
+            )
+             st.sidebar.info("Using API Key Auth")
+             return client
+        else:
+             st.error("Azure OpenAI API Key not found. Please set AZURE_OPENAI_API_KEY environment variable.")
+             return None # Prevent app from running further if no auth method works
+
+if "azure_openai_client" not in st.session_state:
+    client = get_azure_client(AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_VERSION, AZURE_OPENAI_API_KEY)
+    # Check if client initialization failed
+    if not client:
+        st.stop()
+    st.session_state.azure_openai_client = client
+azure_openai_client = st.session_state.azure_openai_client
+
+
+# --- Background Event Loop ---
+# Pooled HTTP connections and MCP stdio streams are bound to the event loop that opened them, so each browser
+# session runs its async work on one long-lived loop of its own instead of a fresh asyncio.run() loop per rerun.
+# The loop thread only ever carries its own session's ScriptRunContext, so sessions cannot write into each other.
+def run_event_loop(loop: asyncio.AbstractEventLoop) -> None:
+    """Runs a session's loop until its watchdog stops it, then closes it."""
+    loop.run_forever()
+    loop.close()
+
+def is_browser_session_active(session_id: str) -> bool:
+    """True while the Streamlit session that owns a loop is still connected."""
+    return Runtime.exists() and Runtime.instance().is_active_session(session_id)
+
+async def watch_browser_session(session_id: str, client: Optional[openai.AsyncAzureOpenAI]) -> None:
+    """Shuts down a session's loop once the session has been gone for SESSION_GRACE_PERIOD seconds."""
+    inactive_since = None
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        if is_browser_session_active(session_id):
+            inactive_since = None
+        elif inactive_since is None:
+            inactive_since = time.monotonic()
+        elif time.monotonic() - inactive_since >= SESSION_GRACE_PERIOD:
+            break
+    # Cancelled connection tasks exit their own stdio and session contexts, which stops the server subprocesses
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if client is not None:
+        await client.close()
+    asyncio.get_running_loop().stop()
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Returns this browser session's background loop, starting it and its watchdog on first use."""
+    if "event_loop" not in st.session_state:
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=run_event_loop, args=(loop,), daemon=True).start()
+        asyncio.run_coroutine_threadsafe(
+            watch_browser_session(get_script_run_ctx().session_id, st.session_state.get("azure_openai_client")), loop
+        )
+        st.session_state.event_loop = loop
+    return st.session_state.event_loop
 
-# Check if client initialization failed
-if not azure_openai_client:
-    st.stop()
+def run_async(coro) -> Any:
+    """Runs a coroutine on the session's background loop and blocks until it completes."""
+    ctx = get_script_run_ctx()
+
+    async def with_script_run_ctx():
+        # Let st.* calls made by the coroutine reach the current session
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return await coro
+
+    return asyncio.run_coroutine_threadsafe(with_script_run_ctx(), get_event_loop()).result()
 
 
 # --- Helper Functions (MCP parts remain mostly the same) ---
 
+@st.cache_resource
+def load_mcp_config_cached(config_path: str, mtime: float) -> Dict[str, Dict]:
+    """Parses the MCP server configurations once per file version (`mtime` only serves as part of the cache key)."""
+    with open(config_path, 'rb') as f:
+        return orjson.loads(f.read()).get("mcpServers", {})
+
 def load_mcp_config(config_path: str) -> Dict[str, Dict]:
     """Loads MCP server configurations from a JSON file."""
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
+        # Keyed on the modification time, so editing the file invalidates the cached parse
+        servers = load_mcp_config_cached(config_path, os.path.getmtime(config_path))
         st.success(f"Loaded configuration from {config_path}")
-        return config.get("mcpServers", {})
+        return servers
     except FileNotFoundError:
         st.warning(f"Configuration file not found at {config_path}. No MCP servers will be started.")
         return {}
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         st.error(f"Error: Could not decode JSON from {config_path}")
         return {}
     except Exception as e:
@@ -80,12 +191,34 @@ def convert_mcp_tool_to_openai_tool(mcp_tool: mcp_types.Tool) -> Dict:
     Converts an MCP Tool object to the OpenAI/Azure OpenAI JSON tool format.
     (This function remains largely the same as the format is compatible)
     Ref: Based on Section 9, Replacing Claude Desktop with Ollama doc & Section 2/4 LLM Backend API Differences doc.
+    The conversion is cached per (name, description, schema), so repeated turns reuse the result.
     """
+    schema_json = json.dumps(mcp_tool.inputSchema, sort_keys=True)
+    return _convert_cached(mcp_tool.name, mcp_tool.description, schema_json)
+
+PASSTHROUGH_SCHEMA_KEYS = frozenset({"type", "description", "enum", "items", "properties", "required", "title", "default"})
+
+def is_openai_compatible_schema(schema: Any) -> bool:
+    """True if a JSON schema only uses keys that OpenAI tool parameters accept as-is."""
+    if not isinstance(schema, dict) or not schema.keys() <= PASSTHROUGH_SCHEMA_KEYS:
+        return False
+    properties = schema.get("properties", {})
+    if not isinstance(properties, dict) or not all(is_openai_compatible_schema(prop) for prop in properties.values()):
+        return False
+    return "items" not in schema or is_openai_compatible_schema(schema["items"])
+
+@st.cache_data(max_entries=512)
+def _convert_cached(name: str, description: Optional[str], schema_json: str) -> Dict:
+    """Builds the OpenAI tool dict from a tool's name, description and serialized input schema."""
+    input_schema = json.loads(schema_json)
+    if is_openai_compatible_schema(input_schema) and input_schema.get("type") == "object":
+        # Simple MCP schemas are already valid OpenAI parameters, so skip the property walk
+        return {"type": "function", "function": {"name": name, "description": description, "parameters": input_schema}}
     openai_params = {"type": "object", "properties": {}, "required": []}
     required_params = []
 
-    if mcp_tool.inputSchema and isinstance(mcp_tool.inputSchema, dict):
-        schema_props = mcp_tool.inputSchema.get('properties', {})
+    if input_schema and isinstance(input_schema, dict):
+        schema_props = input_schema.get('properties', {})
         if isinstance(schema_props, dict):
             for param_name, param_schema in schema_props.items():
                  if isinstance(param_schema, dict):
@@ -96,7 +229,7 @@ def convert_mcp_tool_to_openai_tool(mcp_tool: mcp_types.Tool) -> Dict:
                     if "enum" in param_schema and isinstance(param_schema["enum"], list):
                          openai_params["properties"][param_name]["enum"] = param_schema["enum"]
 
-        schema_required = mcp_tool.inputSchema.get('required', [])
+        schema_required = input_schema.get('required', [])
         if isinstance(schema_required, list):
             required_params = schema_required
             if required_params:
@@ -105,41 +238,89 @@ def convert_mcp_tool_to_openai_tool(mcp_tool: mcp_types.Tool) -> Dict:
     return {
         "type": "function",
         "function": {
-            "name": mcp_tool.name,
-            "description": mcp_tool.description,
+            "name": name,
+            "description": description,
             "parameters": openai_params
         }
     }
 
+async def maintain_mcp_connection(server_name: str, server_params: StdioServerParameters, sessions: Dict[str, ClientSession],
+                                  stale: Set[str], ready: asyncio.Future, stop: asyncio.Event) -> None:
+    """Owns one server's stdio subprocess and ClientSession on the background loop, with heartbeat and reconnect."""
+    async def handle_message(message) -> None:
+        # The server's tool list changed, so the cached tools are rediscovered on the next turn
+        if isinstance(message, mcp_types.ServerNotification) and isinstance(message.root, mcp_types.ToolListChangedNotification):
+            stale.add(server_name)
+
+    failures = 0
+    while not stop.is_set():
+        session = None
+        try:
+            async with AsyncExitStack() as stack:
+                async with asyncio.timeout(15.0):
+                    read, write = await stack.enter_async_context(stdio_client(server_params))
+                session = await stack.enter_async_context(ClientSession(read, write, message_handler=handle_message))
+                async with asyncio.timeout(10.0):
+                    await session.initialize()
+                session.alive = True # Checked per tool call instead of probing the underlying streams
+                sessions[server_name] = session
+                failures = 0
+                if not ready.done():
+                    ready.set_result(session)
+                else:
+                    stale.add(server_name) # A restarted server may offer different tools
+                while not stop.is_set():
+                    try:
+                        async with asyncio.timeout(HEARTBEAT_INTERVAL):
+                            await stop.wait()
+                    except asyncio.TimeoutError:
+                        async with asyncio.timeout(10.0):
+                            await session.send_ping()
+        except Exception as e:
+            if session is not None:
+                session.alive = False
+            if not ready.done():
+                ready.set_exception(e) # The initial connection failed, let the caller report it
+                return
+            # Heartbeat or connection failed: drop the dead session and reconnect after a capped exponential
+            # backoff with full jitter, so a server that keeps failing is not respawned in lockstep
+            sessions.pop(server_name, None)
+            delay = random.random() * min(RECONNECT_MAX_DELAY, RECONNECT_DELAY * 2 ** failures)
+            failures += 1
+            try:
+                async with asyncio.timeout(delay):
+                    await stop.wait()
+            except asyncio.TimeoutError:
+                pass
+    if session is not None:
+        session.alive = False
+    sessions.pop(server_name, None)
+
 async def connect_and_init_mcp_server(server_name: str, config: Dict) -> Optional[ClientSession]:
     """Connects to a single MCP server via stdio and initializes the session."""
-    # (This function is identical to the previous version)
+    server_params = StdioServerParameters(
+        command=config["command"],
+        args=config.get("args"),
+        env=config.get("env"),
+        cwd=config.get("cwd")
+    )
+    ready = asyncio.get_running_loop().create_future()
+    stop = asyncio.Event()
+    task = asyncio.create_task(maintain_mcp_connection(server_name, server_params, st.session_state.mcp_sessions,
+                                                       st.session_state.stale_tool_servers, ready, stop))
     try:
-        server_params = StdioServerParameters(
-            command=config["command"],
-            args=config.get("args"),
-            env=config.get("env"),
-            cwd=config.get("cwd")
-        )
-        read, write = await asyncio.wait_for(stdio_client(server_params).__aenter__(), timeout=15.0)
-        session = ClientSession(read, write)
-        await asyncio.wait_for(session.initialize(), timeout=10.0)
-        st.session_state.mcp_raw_streams[server_name] = (read, write)
-        st.sidebar.success(f"Connected: {server_name}")
+        session = await asyncio.wait_for(asyncio.shield(ready), timeout=30.0)
+        st.session_state.mcp_connections[server_name] = (task, stop)
+        # Cap concurrent tool calls so parallel fan-out cannot flood the server's stdio pipe
+        st.session_state.mcp_semaphores[server_name] = asyncio.Semaphore(config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
         return session
     except asyncio.TimeoutError:
-        st.sidebar.error(f"Timeout connecting/initializing {server_name}")
-        if server_name in st.session_state.get('mcp_raw_streams', {}):
-            read, write = st.session_state.mcp_raw_streams[server_name]
-            if write and not write.is_closing(): write.close()
-            del st.session_state.mcp_raw_streams[server_name]
+        st.session_state.mcp_connect_errors[server_name] = "Timeout connecting/initializing"
+        task.cancel()
         return None
     except Exception as e:
-        st.sidebar.error(f"Failed to connect {server_name}: {e}")
-        if server_name in st.session_state.get('mcp_raw_streams', {}):
-             read, write = st.session_state.mcp_raw_streams[server_name]
-             if write and not write.is_closing(): write.close()
-             del st.session_state.mcp_raw_streams[server_name]
+        st.session_state.mcp_connect_errors[server_name] = f"Failed to connect: {e}"
+        task.cancel()
         return None
 
 
@@ -157,21 +338,93 @@ async def discover_tools(session: ClientSession, server_name: str) -> List[mcp_t
         st.warning(f"Error discovering tools from {server_name}: {e}")
         return []
 
+def compile_tool_validator(mcp_tool: mcp_types.Tool) -> Optional[Callable]:
+    """Compiles a tool's input schema into a validator once, or returns None if that is not possible."""
+    if fastjsonschema is None or not isinstance(mcp_tool.inputSchema, dict):
+        return None
+    try:
+        return fastjsonschema.compile(mcp_tool.inputSchema)
+    except fastjsonschema.JsonSchemaDefinitionException as e:
+        st.warning(f"Could not compile input schema for tool '{mcp_tool.name}': {e}")
+        return None
+
+# Local pseudo-tool, answered from the chat history rather than an MCP server
+FETCH_TOOL_RESULT_NAME = "fetch_tool_result"
+FETCH_TOOL_RESULT_TOOL = {
+    "type": "function",
+    "function": {
+        "name": FETCH_TOOL_RESULT_NAME,
+        "description": "Fetch the full content of an earlier tool result that was truncated, by its ref.",
+        "parameters": {
+            "type": "object",
+            "properties": {"ref": {"type": "string", "description": "The ref from a truncated tool result."}},
+            "required": ["ref"],
+        },
+    },
+}
+
+def tool_result_preview(message: Dict) -> Dict:
+    """Returns a tool message with a large result replaced by a preview plus a ref for fetch_tool_result."""
+    if message["role"] != "tool" or len(message["content"]) <= TOOL_RESULT_INLINE_LIMIT:
+        return message
+    content = message["content"]
+    preview = f"[truncated; {len(content)} bytes; ref={message['tool_call_id']}] " + content[:TOOL_RESULT_PREVIEW_CHARS]
+    return {**message, "content": preview}
+
+def fetch_tool_result(ref: str) -> str:
+    """Returns the full result of the earlier tool call whose id is ref."""
+    for message in reversed(st.session_state.messages):
+        if message["role"] == "tool" and message.get("tool_call_id") == ref:
+            return message["content"]
+    return f"Error: No stored tool result for ref '{ref}'"
+
+async def discover_all_tools() -> None:
+    """Discovers tools from all active MCP sessions and caches them for later turns."""
+    st.session_state.tool_map = {}
+    all_mcp_tools = []
+    tasks = []
+    server_names = []
+    for server_name, session in st.session_state.mcp_sessions.items():
+         if getattr(session, 'alive', False):
+             tasks.append(discover_tools(session, server_name))
+             server_names.append(server_name)
+         else:
+             st.warning(f"Session for {server_name} seems inactive.")
+    results = await asyncio.gather(*tasks)
+    for server_name, tools in zip(server_names, results):
+        all_mcp_tools.extend(tools)
+        for tool in tools:
+            st.session_state.tool_map[tool.name] = server_name
+
+    st.session_state.openai_tools_list = [convert_mcp_tool_to_openai_tool(tool) for tool in all_mcp_tools]
+    if all_mcp_tools:
+        st.session_state.openai_tools_list.append(FETCH_TOOL_RESULT_TOOL)
+    st.session_state.tool_validators = {tool.name: compile_tool_validator(tool) for tool in all_mcp_tools}
+
 async def call_mcp_tool(server_name: str, tool_name: str, args: Dict) -> Any:
     """Calls a specific tool on a specific MCP server."""
     # (This function is identical to the previous version)
     if server_name not in st.session_state.mcp_sessions:
         return f"Error: No active session for server '{server_name}'"
     session = st.session_state.mcp_sessions[server_name]
+    validator = st.session_state.tool_validators.get(tool_name)
+    if validator is not None:
+        # Reject invalid arguments locally instead of paying a round trip to the server
+        try:
+            validator(args)
+        except fastjsonschema.JsonSchemaValueException as e:
+            st.error(f"Invalid arguments for tool '{tool_name}': {e.message}")
+            return f"Error: Invalid arguments for tool '{tool_name}': {e.message}"
     try:
-        if not session.read or session.read.at_eof():
+        if not getattr(session, 'alive', False):
              raise ConnectionError(f"Session for {server_name} appears closed.")
         st.info(f"Calling tool '{tool_name}' on server '{server_name}' with args: {args}")
-        result = await asyncio.wait_for(
-            session.call_tool(tool_name=tool_name, arguments=args),
-            timeout=60.0
-        )
-        if isinstance(result, (dict, list)): return json.dumps(result)
+        async with st.session_state.mcp_semaphores[server_name]:
+            result = await asyncio.wait_for(
+                session.call_tool(tool_name=tool_name, arguments=args),
+                timeout=60.0
+            )
+        if isinstance(result, (dict, list)): return orjson.dumps(result).decode()
         else: return str(result)
     except asyncio.TimeoutError:
         st.error(f"Timeout calling tool '{tool_name}' on {server_name}")
@@ -183,17 +436,95 @@ async def call_mcp_tool(server_name: str, tool_name: str, args: Dict) -> Any:
         st.error(f"Error calling tool '{tool_name}' on {server_name}: {e}")
         return f"Error calling tool '{tool_name}': {e}"
 
-async def get_azure_openai_response(messages: List[Dict], available_tools: List[Dict]) -> Dict:
-    """Gets a response from Azure OpenAI, potentially requesting tool use."""
+@st.cache_resource
+def get_response_cache() -> "OrderedDict[str, Tuple[float, Dict]]":
+    """LRU of Azure OpenAI responses keyed by a hash of the request, shared across reruns."""
+    return OrderedDict()
+
+@st.cache_resource
+def get_response_cache_lock() -> threading.Lock:
+    """Guards the response cache, which every session's loop thread reads and writes."""
+    return threading.Lock()
+
+def get_cached_response(cache_key: str) -> Optional[Dict]:
+    """Returns a copy of a cached response that has not expired, counting the hit or miss."""
+    cache = get_response_cache()
+    with get_response_cache_lock():
+        entry = cache.get(cache_key)
+        if entry is not None and time.monotonic() - entry[0] < RESPONSE_CACHE_TTL:
+            cache.move_to_end(cache_key)
+        else:
+            entry = None
+    if entry is not None:
+        st.session_state.response_cache_hits += 1
+        return copy.deepcopy(entry[1]) # Callers append it to the history, so never hand out the cached dict
+    st.session_state.response_cache_misses += 1
+    return None
+
+def store_cached_response(cache_key: str, message: Dict) -> None:
+    """Caches a response, evicting the least recently used entries beyond the size limit."""
+    cache = get_response_cache()
+    entry = (time.monotonic(), copy.deepcopy(message))
+    with get_response_cache_lock():
+        cache[cache_key] = entry
+        cache.move_to_end(cache_key)
+        while len(cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            cache.popitem(last=False)
+
+async def get_azure_openai_response(messages: List[Dict], available_tools: List[Dict], placeholder=None) -> Dict:
+    """
+    Gets a streamed response from Azure OpenAI, potentially requesting tool use.
+    Content is rendered into `placeholder` (an st.empty()) as it arrives; the assembled message dict is returned.
+    At temperature 0 the output is deterministic, so identical requests are served from the response cache.
+    """
+    cache_key = None
+    if RESPONSE_CACHE_ENABLED:
+        cache_key = hashlib.blake2b(orjson.dumps([messages, available_tools])).hexdigest()
+        cached_message = get_cached_response(cache_key)
+        if cached_message is not None:
+            if placeholder is not None and cached_message.get("content"):
+                placeholder.markdown(cached_message["content"])
+            return cached_message
     try:
-        response = await azure_openai_client.chat.completions.create(
+        stream = await azure_openai_client.chat.completions.create(
             model=AZURE_OPENAI_DEPLOYMENT_NAME,
             messages=messages,
-            tools=available_tools if available_tools else None, # Pass tools if any
-            tool_choice="auto" # Let the model decide whether to use tools
+            tools=available_tools if available_tools else openai.NOT_GIVEN, # Pass tools if any
+            tool_choice="auto" if available_tools else openai.NOT_GIVEN, # Let the model decide whether to use tools
+            temperature=AZURE_OPENAI_TEMPERATURE if AZURE_OPENAI_TEMPERATURE is not None else openai.NOT_GIVEN,
+            stream=True
         )
-        # Return the assistant's message object (openai v1.x format)
-        return response.choices[0].message.model_dump() # Convert Pydantic model to dict
+        content_parts = []
+        tool_calls: Dict[int, Dict] = {} # Tool calls arrive as fragments keyed by index
+        async for chunk in stream:
+            if not chunk.choices: # Azure sends content-filter results in chunks without choices
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content_parts.append(delta.content)
+                if placeholder is not None:
+                    placeholder.markdown("".join(content_parts))
+            for tool_call_delta in delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(tool_call_delta.index, {
+                    "id": None,
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""}
+                })
+                if tool_call_delta.id:
+                    tool_call["id"] = tool_call_delta.id
+                if tool_call_delta.function:
+                    if tool_call_delta.function.name:
+                        tool_call["function"]["name"] += tool_call_delta.function.name
+                    if tool_call_delta.function.arguments:
+                        tool_call["function"]["arguments"] += tool_call_delta.function.arguments
+
+        # Assemble the assistant's message (openai v1.x format)
+        message = {"role": "assistant", "content": "".join(content_parts) or None}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+        if cache_key is not None:
+            store_cached_response(cache_key, message)
+        return message
     except openai.APIError as e:
         st.error(f"Azure OpenAI API Error: {e.message} (Status: {e.status_code}, Type: {e.type})")
         return {"role": "assistant", "content": f"Error contacting Azure OpenAI: {e.message}"}
@@ -204,44 +535,30 @@ async def get_azure_openai_response(messages: List[Dict], available_tools: List[
         st.error(f"Error during Azure OpenAI call: {e}")
         return {"role": "assistant", "content": f"Error during Azure OpenAI call: {e}"}
 
+def recent_messages(messages: List[Dict]) -> List[Dict]:
+    """Returns the history to send, trimmed to the most recent whole turns for long conversations."""
+    # Sliced rather than trimmed in place like the other clients do, since the chat panel renders the full history
+    window = messages[history_start(messages):]
+    # Large tool results from earlier turns go out as previews; the current turn's results are sent in full.
+    # The history itself keeps the full results, for display and for fetch_tool_result.
+    current_turn = max((i for i, message in enumerate(window) if message["role"] == "user"), default=0)
+    return [tool_result_preview(message) if i < current_turn else message for i, message in enumerate(window)]
+
 async def orchestrate_conversation_turn(user_prompt: str) -> None:
     """Handles one turn of the conversation using Azure OpenAI."""
     # 1. Add user message
     st.session_state.messages.append({"role": "user", "content": user_prompt})
 
-    # 2. Discover tools (same as before)
-    ollama_tools_list = [] # Rename variable for clarity, format is OpenAI compatible
-    st.session_state.tool_map = {}
-    with st.spinner("Discovering tools..."):
-        all_mcp_tools = []
-        tasks = []
-        active_sessions = list(st.session_state.mcp_sessions.items())
-        for server_name, session in active_sessions:
-             if session and session.read and not session.read.at_eof():
-                 tasks.append(discover_tools(session, server_name))
-             else:
-                 st.warning(f"Session for {server_name} seems inactive.")
-        results = await asyncio.gather(*tasks)
-        for i, tools in enumerate(results):
-            server_name = active_sessions[i][0]
-            all_mcp_tools.extend(tools)
-            for tool in tools:
-                st.session_state.tool_map[tool.name] = server_name
-
-    if all_mcp_tools:
-        st.sidebar.write("Discovered Tools:")
-        for tool in all_mcp_tools:
-             st.sidebar.caption(f"- {tool.name} ({st.session_state.tool_map.get(tool.name, 'Unknown')})")
-        openai_tools_list = [convert_mcp_tool_to_openai_tool(tool) for tool in all_mcp_tools]
-    else:
-         st.sidebar.write("No tools discovered.")
-         openai_tools_list = []
+    # 2. Reuse the tools discovered at connect time, unless a server reported that its tools changed
+    if st.session_state.stale_tool_servers:
+        st.session_state.stale_tool_servers.clear()
+        await discover_all_tools()
+    openai_tools_list = st.session_state.openai_tools_list
 
-    # 3. Call Azure OpenAI
-    with st.spinner(f"Asking Azure OpenAI ({AZURE_OPENAI_DEPLOYMENT_NAME})..."):
-        # Pass the dict version of the message history
-        api_messages = [msg for msg in st.session_state.messages]
-        assistant_response_dict = await get_azure_openai_response(api_messages, openai_tools_list)
+    # 3. Call Azure OpenAI, streaming the reply into the chat as it is generated
+    with st.chat_message("assistant"):
+        response_placeholder = st.empty()
+        assistant_response_dict = await get_azure_openai_response(recent_messages(st.session_state.messages), openai_tools_list, response_placeholder)
 
     # Convert back to Message object potentially needed if adding directly? No, dict is fine for history.
     assistant_response_message = assistant_response_dict # Keep as dict for history
@@ -254,14 +571,18 @@ async def orchestrate_conversation_turn(user_prompt: str) -> None:
         st.session_state.messages.append(assistant_response_message) # Add assistant's msg
 
         tool_results_messages = []
+        # Parse all arguments first, keeping per-call error strings, then run the valid calls concurrently
+        tool_result_contents = []
+        pending_calls = {} # Index into tool_calls -> call_mcp_tool coroutine
         for tool_call in tool_calls:
-            tool_call_id = tool_call['id'] # Required for OpenAI response
             tool_name = tool_call['function']['name']
+            tool_result_content = None
             # Arguments are a JSON *string* in OpenAI response, needs parsing
             try:
                 tool_args_str = tool_call['function']['arguments']
-                tool_args = json.loads(tool_args_str)
-            except json.JSONDecodeError:
+                # No-argument tools usually stream back "" or "{}"; skip the parser for those
+                tool_args = {} if not tool_args_str or tool_args_str.strip() in ("", "{}") else orjson.loads(tool_args_str)
+            except orjson.JSONDecodeError:
                 st.error(f"Error: Could not decode JSON arguments for tool '{tool_name}': {tool_args_str}")
                 tool_args = None
                 tool_result_content = f"Error: Invalid arguments received for tool '{tool_name}'."
@@ -269,21 +590,50 @@ async def orchestrate_conversation_turn(user_prompt: str) -> None:
                  st.error(f"Error parsing arguments for tool '{tool_name}': {e}")
                  tool_args = None
                  tool_result_content = f"Error: Could not parse arguments for tool '{tool_name}'."
+            if tool_args is not None and not isinstance(tool_args, dict):
+                st.error(f"Error: Arguments for tool '{tool_name}' are not a JSON object: {tool_args_str}")
+                tool_args = None
+                tool_result_content = f"Error: Arguments for tool '{tool_name}' must be a JSON object."
 
 
-            if tool_args is not None:
+            if tool_args is not None and tool_name == FETCH_TOOL_RESULT_NAME:
+                tool_result_content = fetch_tool_result(str(tool_args.get("ref", "")))
+            elif tool_args is not None:
                 server_name = st.session_state.tool_map.get(tool_name)
                 if server_name:
-                    tool_result_content = await call_mcp_tool(server_name, tool_name, tool_args)
+                    pending_calls[len(tool_result_contents)] = call_mcp_tool(server_name, tool_name, tool_args)
                 else:
                     st.error(f"Error: Tool '{tool_name}' requested but no providing server found.")
                     tool_result_content = f"Error: Could not find server for tool '{tool_name}'"
 
+            tool_result_contents.append(tool_result_content)
+
+        async def indexed_call(index: int, coro) -> Tuple[int, Any]:
+            try:
+                return index, await coro
+            except Exception as e:
+                return index, e
+
+        if pending_calls:
+            # Report each tool as it finishes; results still go back to the model in tool_calls order
+            with st.status(f"Running {len(pending_calls)} tool call(s)...") as status:
+                for fut in asyncio.as_completed([indexed_call(index, coro) for index, coro in pending_calls.items()]):
+                    index, result = await fut
+                    tool_name = tool_calls[index]['function']['name']
+                    if isinstance(result, Exception):
+                        st.error(f"Error calling tool '{tool_name}': {result}")
+                        result = f"Error calling tool '{tool_name}': {result}"
+                    tool_result_contents[index] = result
+                    status.write(f"Tool '{tool_name}' done")
+                    st.toast(f"Tool '{tool_name}' done")
+                status.update(label=f"Ran {len(pending_calls)} tool call(s)", state="complete")
+
+        for tool_call, tool_result_content in zip(tool_calls, tool_result_contents):
             # Append result for this specific tool call, including tool_call_id
             tool_results_messages.append({
                 "role": "tool",
-                "tool_call_id": tool_call_id, # Crucial for OpenAI
-                "name": tool_name, # Optional but good practice? Check API spec.
+                "tool_call_id": tool_call['id'], # Crucial for OpenAI
+                "name": tool_call['function']['name'], # Optional but good practice? Check API spec.
                 "content": tool_result_content,
             })
 
@@ -291,49 +641,51 @@ async def orchestrate_conversation_turn(user_prompt: str) -> None:
         st.session_state.messages.extend(tool_results_messages)
 
         # 6. Call Azure OpenAI again with tool results
-        with st.spinner("Processing tool results..."):
-            # Pass the updated dict version of the message history
-            api_messages_with_results = [msg for msg in st.session_state.messages]
-            final_response_dict = await get_azure_openai_response(api_messages_with_results, []) # No tools needed
+        with st.chat_message("assistant"):
+            final_placeholder = st.empty()
+            final_response_dict = await get_azure_openai_response(recent_messages(st.session_state.messages), [], final_placeholder) # No tools needed
 
         st.session_state.messages.append(final_response_dict) # Add final response dict
     else:
         # No tool calls, just add the direct response dict
         st.session_state.messages.append(assistant_response_message)
 
-    st.rerun()
+    st.rerun(scope="fragment")
 
 
 async def cleanup_mcp_session(server_name: str):
     """Gracefully shuts down a single MCP session and cleans up resources."""
-    # (This function is identical to the previous version)
     st.sidebar.write(f"Cleaning up session: {server_name}...")
     session = st.session_state.mcp_sessions.pop(server_name, None)
-    streams = st.session_state.mcp_raw_streams.pop(server_name, None)
-    if session:
-        try: pass # SDK context manager handles shutdown
-        except Exception as e: st.sidebar.warning(f"Error during shutdown for {server_name}: {e}")
-    if streams:
-        read, write = streams
+    if session is not None:
+        session.alive = False
+    connection = st.session_state.mcp_connections.pop(server_name, None)
+    st.session_state.mcp_semaphores.pop(server_name, None)
+    if connection:
+        task, stop = connection
+        # The connection task exits its own context managers, which closes the session and the subprocess
+        stop.set()
         try:
-            if write and not write.is_closing():
-                write.close()
-                await write.wait_closed()
-        except Exception as e: st.sidebar.warning(f"Error closing streams for {server_name}: {e}")
+            await asyncio.wait_for(task, timeout=10.0)
+        except Exception as e: st.sidebar.warning(f"Error during shutdown for {server_name}: {e}")
     st.sidebar.success(f"Cleaned up: {server_name}")
 
 
 async def cleanup_all_mcp_sessions():
     """Cleans up all active MCP sessions."""
-    # (This function is identical to the previous version)
     st.sidebar.write("Cleaning up all MCP sessions...")
-    server_names = list(st.session_state.mcp_sessions.keys())
+    server_names = list(st.session_state.mcp_connections.keys())
     tasks = [cleanup_mcp_session(name) for name in server_names]
     await asyncio.gather(*tasks)
     st.session_state.mcp_sessions = {}
     st.session_state.mcp_server_tools = {}
     st.session_state.tool_map = {}
-    st.session_state.mcp_raw_streams = {}
+    st.session_state.openai_tools_list = []
+    st.session_state.tool_validators = {}
+    st.session_state.mcp_connections = {}
+    st.session_state.mcp_connect_errors = {}
+    st.session_state.mcp_semaphores = {}
+    st.session_state.stale_tool_servers = set()
     st.sidebar.write("Cleanup complete.")
 
 
@@ -349,68 +701,116 @@ if 'initialized' not in st.session_state:
     st.session_state.mcp_sessions = {}
     st.session_state.mcp_server_tools = {}
     st.session_state.tool_map = {}
-    st.session_state.mcp_raw_streams = {}
+    st.session_state.openai_tools_list = []
+    st.session_state.tool_validators = {}
+    st.session_state.mcp_connections = {} # Server name -> (connection task, stop event)
+    st.session_state.mcp_connect_errors = {} # Server name -> reason the initial connection failed
+    st.session_state.mcp_semaphores = {}
+    st.session_state.stale_tool_servers = set() # Servers whose tool list changed since the last discovery
+    st.session_state.response_cache_hits = 0
+    st.session_state.response_cache_misses = 0
 
-    st.sidebar.header("MCP Server Status")
     mcp_configs = load_mcp_config(CONFIG_FILE)
 
     async def connect_all():
         tasks = []
         for server_name, config in mcp_configs.items():
-             st.sidebar.write(f"Connecting to {server_name}...")
              tasks.append(connect_and_init_mcp_server(server_name, config))
         results = await asyncio.gather(*tasks)
         for i, session in enumerate(results):
             server_name = list(mcp_configs.keys())[i]
             if session: st.session_state.mcp_sessions[server_name] = session
-            else: st.sidebar.error(f"Connection failed for {server_name}")
+        # Tool inventories are static for a session, so discover them once here
+        with st.spinner("Discovering tools..."):
+            await discover_all_tools()
 
     try:
-        asyncio.run(connect_all())
-    except RuntimeError as e:
-        if "cannot run event loop while another loop is running" in str(e):
-             st.warning("Could not auto-connect MCP servers (event loop running).")
-        else: st.error(f"Error during initial connection: {e}")
+        run_async(connect_all())
+    except Exception as e:
+        st.error(f"Error during initial connection: {e}")
 
     st.session_state.initialized = True
     st.rerun()
 
-# --- Display Chat History ---
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        # Display tool calls differently (OpenAI format)
-        if message["role"] == "assistant" and message.get("tool_calls"):
-            st.write("Requesting tool calls:")
-            for tc in message["tool_calls"]:
-                 # Arguments are a string, display as is or try to pretty-print JSON
-                 args_display = tc['function']['arguments']
-                 try:
-                     args_display = json.dumps(json.loads(args_display), indent=2)
-                 except:
-                     pass # Keep as string if not valid JSON
-                 st.code(f"ID: {tc['id']}\nTool: {tc['function']['name']}\nArgs: {args_display}", language="json")
-            if message.get("content"):
-                 st.markdown(message["content"])
-        elif message["role"] == "tool":
-             st.markdown(f"**Tool Result (ID: {message.get('tool_call_id')})**:\n```\n{message['content']}\n```")
+# --- MCP Server Status ---
+# One table instead of a sidebar element per server and per tool keeps each rerun's delta payload small.
+# A fragment on a timer, since chat turns only rerun the chat pane and reconnects happen in the background.
+@st.fragment(run_every=STATUS_REFRESH_INTERVAL)
+def server_status_panel():
+    st.header("MCP Server Status")
+    server_tools = {}
+    for tool_name, server_name in st.session_state.tool_map.items():
+        server_tools.setdefault(server_name, []).append(tool_name)
+    status_rows = []
+    for server_name in st.session_state.mcp_connections.keys() | st.session_state.mcp_connect_errors.keys():
+        if server_name in st.session_state.mcp_sessions:
+            status = "Connected"
+        elif server_name in st.session_state.mcp_connections:
+            status = "Reconnecting"
         else:
-            st.markdown(message.get("content", "*No content*")) # Handle potential null content
+            status = st.session_state.mcp_connect_errors[server_name]
+        status_rows.append({"Server": server_name, "Status": status, "Tools": ", ".join(server_tools.get(server_name, []))})
+    if status_rows:
+        st.dataframe(sorted(status_rows, key=lambda row: row["Server"]), hide_index=True)
+    else:
+        st.write("No MCP servers connected.")
 
+    if RESPONSE_CACHE_ENABLED:
+        st.caption(f"Response cache: {st.session_state.response_cache_hits} hits / {st.session_state.response_cache_misses} misses")
 
-# --- Chat Input ---
-if prompt := st.chat_input("Ask Azure OpenAI..."):
-    with st.chat_message("user"):
-        st.markdown(prompt)
-    try:
-         asyncio.run(orchestrate_conversation_turn(prompt))
-    except Exception as e:
-         st.error(f"An error occurred: {e}")
+
+with st.sidebar:
+    server_status_panel()
+
+if st.sidebar.button("Refresh Tools"):
+     try:
+         run_async(discover_all_tools())
+         st.rerun()
+     except Exception as e:
+         st.error(f"Error refreshing tools: {e}")
+
+# --- Chat Pane ---
+# A fragment, so sending a message reruns only the chat pane and not the sidebar or the client setup above
+@st.fragment
+def chat_panel():
+    # --- Display Chat History ---
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            # Display tool calls differently (OpenAI format)
+            if message["role"] == "assistant" and message.get("tool_calls"):
+                st.write("Requesting tool calls:")
+                for tc in message["tool_calls"]:
+                     # Arguments are a string, display as is or try to pretty-print JSON
+                     args_display = tc['function']['arguments']
+                     try:
+                         args_display = json.dumps(json.loads(args_display), indent=2)
+                     except:
+                         pass # Keep as string if not valid JSON
+                     st.code(f"ID: {tc['id']}\nTool: {tc['function']['name']}\nArgs: {args_display}", language="json")
+                if message.get("content"):
+                     st.markdown(message["content"])
+            elif message["role"] == "tool":
+                 st.markdown(f"**Tool Result (ID: {message.get('tool_call_id')})**:\n```\n{message['content']}\n```")
+            else:
+                st.markdown(message.get("content", "*No content*")) # Handle potential null content
+
+    # --- Chat Input ---
+    if prompt := st.chat_input("Ask Azure OpenAI..."):
+        with st.chat_message("user"):
+            st.markdown(prompt)
+        try:
+             run_async(orchestrate_conversation_turn(prompt))
+        except Exception as e:
+             st.error(f"An error occurred: {e}")
+
+
+chat_panel()
 
 
 # --- Cleanup Logic ---
 if st.sidebar.button("Disconnect All MCP Servers"):
      try:
-         asyncio.run(cleanup_all_mcp_sessions())
+         run_async(cleanup_all_mcp_sessions())
          st.session_state.initialized = False
          st.rerun()
      except Exception as e: